@@ -1,72 +1,94 @@
 # -*- coding: utf-8 -*-
+import ctypes
+import multiprocessing
+import os
+import queue
+import re
+import select
+import signal
+import socket
+import struct
 import time
+from collections import Counter, OrderedDict, deque
 from threading import Lock, Thread
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 
-# --- CONFIGURACIÓN DE SCAPY ---
 try:
-    # AÑADIDO: Raw para inspección del contenido del paquete (carga útil)
-    # AÑADIDO: Ether para obtener la MAC Address (Capa 2)
-    from scapy.all import IP, TCP, UDP, conf, sniff, Raw, Ether 
+    # Serializador JSON en Rust: mucho más rápido que el `json` estándar de Flask.
+    import orjson
+except ImportError as e:
+    raise ImportError(
+        "ERROR CRÍTICO: No se pudo cargar orjson. Instala las dependencias con 'pip install -r requirements.txt'."
+    ) from e
 
-    # ¡MODIFICACIÓN!
-    # En lugar de forzar 'enp4s0', dejamos que Scapy detecte la interfaz
-    # de enrutamiento principal. Esto es mucho más fiable.
-    ACTIVE_INTERFACE = conf.iface
+# --- DETECCIÓN DE LA INTERFAZ DE RED ---
+def detect_default_interface():
+    """Devuelve la interfaz de la ruta por defecto según /proc/net/route."""
+    with open("/proc/net/route") as routes:
+        next(routes)  # Cabecera
+        for line in routes:
+            fields = line.split()
+            # Destino 00000000 = ruta por defecto; flag 0x1 = RTF_UP
+            if fields[1] == "00000000" and int(fields[3], 16) & 0x1:
+                return fields[0]
+    return None
+
+
+try:
+    # En lugar de forzar 'enp4s0', usamos la interfaz de enrutamiento principal
+    # (la misma que Scapy elegía con conf.iface), sin depender de Scapy/libpcap.
+    ACTIVE_INTERFACE = detect_default_interface()
 
     if not ACTIVE_INTERFACE:
-        # Si Scapy no puede encontrar una, lanzamos un error claro.
+        # Si no hay ruta por defecto, lanzamos un error claro.
         raise Exception(
-            "Scapy no pudo detectar una interfaz de red activa (conf.iface está vacío)."
+            "No se encontró una ruta por defecto activa en /proc/net/route."
         )
 
-    print(
-        f"INFO: Scapy cargado exitosamente. Interfaz activa detectada: {ACTIVE_INTERFACE}"
-    )
+    print(f"INFO: Interfaz activa detectada: {ACTIVE_INTERFACE}")
 
-except ImportError as e:
-    raise ImportError(
-        "ERROR CRÍTICO: No se pudo cargar Scapy. Instala Scapy y/o las dependencias de libpcap."
-    ) from e
 except Exception as e:
-    # Error de inicialización (ej. permisos de socket o la detección de arriba).
     raise Exception(
-        f"ERROR CRÍTICO: Fallo al inicializar Scapy. Asegúrate de ejecutar con 'sudo'. Error: {e}"
+        f"ERROR CRÍTICO: No se pudo detectar una interfaz de red activa. Error: {e}"
     ) from e
 
 
 # --- NUEVA FUNCIÓN: Fingerprinting de SO (Basado en TTL) ---
+# Los TTL de los sistemas operativos comunes tienden a empezar en: 64 (Linux/Unix), 128 (Windows).
+# Buscamos la "clase" de TTL más cercana, sabiendo que disminuye con los saltos.
+# El TTL es un byte, así que la clasificación se precalcula en una tabla de 256 entradas.
+OS_FINGERPRINT_TABLE = ["Desconocido/Router"] * 256
+for _ttl in range(50, 71):
+    OS_FINGERPRINT_TABLE[_ttl] = "Linux/Unix (TTL ~64)"
+for _ttl in range(110, 136):
+    OS_FINGERPRINT_TABLE[_ttl] = "Windows (TTL ~128)"
+for _ttl in range(240, 256):
+    OS_FINGERPRINT_TABLE[_ttl] = "Antiguo/IoT (TTL ~255)"
+del _ttl
+
 def get_os_fingerprint(ttl):
     """Estima el Sistema Operativo basado en el valor inicial de TTL."""
-    # Los TTL de los sistemas operativos comunes tienden a empezar en: 64 (Linux/Unix), 128 (Windows).
-    # Buscamos la "clase" de TTL más cercana, sabiendo que disminuye con los saltos.
-    if 50 <= ttl <= 70:
-        return "Linux/Unix (TTL ~64)"
-    elif 110 <= ttl <= 135:
-        return "Windows (TTL ~128)"
-    elif 240 <= ttl <= 255:
-        return "Antiguo/IoT (TTL ~255)"
-    else:
-        return "Desconocido/Router"
+    return OS_FINGERPRINT_TABLE[ttl]
 
 # --- NUEVO: Simulación de Búsqueda de Fabricante por OUI ---
 # NOTA: En un sistema real, usarías la librería 'mac-vendor-lookup' 
+# Claves: OUI como entero de 24 bits (90:3A:D9 -> 0x903AD9), sin formatear cadenas.
 OUI_MAPPING = {
-    "90:3A:D9": "Apple, Inc. (iPhone/Mac)",
-    "00:0C:29": "VMware, Inc.",
-    "00:50:56": "VMware, Inc.",
-    "00:00:0C": "Cisco Systems",
-    "A4:7B:2D": "Samsung",
-    "C8:3E:99": "Dell",
+    0x903AD9: "Apple, Inc. (iPhone/Mac)",
+    0x000C29: "VMware, Inc.",
+    0x005056: "VMware, Inc.",
+    0x00000C: "Cisco Systems",
+    0xA47B2D: "Samsung",
+    0xC83E99: "Dell",
 }
 
-def get_manufacturer(mac):
-    """Simula la búsqueda del fabricante por OUI (primeros 3 octetos de la MAC)."""
-    if mac and mac != "00:00:00:00:00:00":
-        oui = mac[:8].upper() # Formato XX:XX:XX
-        return OUI_MAPPING.get(oui, "Fabricante Desconocido")
+def get_manufacturer(mac_bytes):
+    """Simula la búsqueda del fabricante por OUI (primeros 3 octetos de la MAC en bruto)."""
+    if any(mac_bytes):
+        return OUI_MAPPING.get(int.from_bytes(mac_bytes[:3], "big"), "Fabricante Desconocido")
     return "N/A"
 # -----------------------------------------------------------
 
@@ -81,288 +103,639 @@ DEVICE_TYPES_MAP = {
     3: "Doméstico/IoT (TV, etc.)",
 }
 
+# --- NUEVO: Redes privadas (RFC 1918) como pares (red, máscara) enteros ---
+# Se evalúan con un AND bit a bit sobre la IP origen ya empaquetada como entero.
+PRIVATE_NETWORKS = [
+    (0xC0A80000, 0xFFFF0000),  # 192.168.0.0/16
+    (0x0A000000, 0xFF000000),  # 10.0.0.0/8
+    (0xAC100000, 0xFFF00000),  # 172.16.0.0/12
+]
+
+
+def is_private_ip(ip_int):
+    """Indica si la IP (entero de 32 bits) pertenece a una red privada RFC 1918."""
+    return any(ip_int & mask == network for network, mask in PRIVATE_NETWORKS)
+
+
 # --- CONFIGURACIÓN DE AUDITORÍA ---
 # Unidades: Paquetes
 DETECTION_WINDOW_SIZE = 5  # Número de ciclos para medir la tasa de paquetes.
 DEFAULT_PACKET_LIMIT = 1500  # Límite de paquetes acumulados en la ventana de tiempo para activar la alerta.
-SNIFF_TIMEOUT_S = 3  # Duración de cada ciclo de captura de Scapy
+SNIFF_TIMEOUT_S = 3  # Duración de cada ciclo de captura
+PACKET_LIMIT_MAX_DIGITS = 12  # Longitud máxima aceptada para un límite enviado como texto
+MAX_DEVICES = 4096  # Tope de la tabla de dispositivos (se expulsa el menos reciente no bloqueado)
+# Un escaneo o IPs falsificadas no deben barrer la tabla ni alargar la sección crítica:
+MAX_CYCLE_SOURCES = MAX_DEVICES  # IPs origen distintas que la captura contabiliza por ciclo
+MAX_NEW_DEVICES_PER_CYCLE = 256  # Dispositivos nuevos que se admiten en la tabla por ciclo
+
+# --- CONFIGURACIÓN DEL SOCKET DE CAPTURA (AF_PACKET + BPF) ---
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26  # No está expuesto en el módulo socket de Python
+SO_RCVBUFFORCE = 33  # Como SO_RCVBUF pero sin el tope net.core.rmem_max (requiere root)
+PR_SET_PDEATHSIG = 1  # prctl: señal que recibe este proceso cuando muere su padre
+SOCKET_RCVBUF_BYTES = 32 * 1024 * 1024  # Búfer del kernel para absorber ráfagas
+# Bytes de cada trama que el kernel copia al socket (valor de retorno del BPF):
+# cabeceras Ethernet/IP/TCP máximas + inicio de la carga útil para el Host HTTP.
+CAPTURE_SNAPLEN = 640
+# Búfer de usuario reutilizado en cada recv_into: nunca llega más que el snaplen.
+RECV_BUFFER_SIZE = CAPTURE_SNAPLEN
+HTTP_HOST_SCAN_LIMIT = 512  # La cabecera Host aparece casi siempre al principio
+# Cabecera Host de HTTP (nombre insensible a mayúsculas); el valor no lleva espacios.
+HTTP_HOST_PATTERN = re.compile(rb"\nhost:[ \t]*([^\s]+)", re.IGNORECASE)
+MIN_IPV4_FRAME_LEN = 34  # Cabecera Ethernet (14) + cabecera IPv4 mínima (20)
+DRAIN_DEADLINE_CHECK = 256  # Cada cuántos paquetes se mira el fin de ciclo al vaciar el socket
+
+# Formatos precompilados para leer las cabeceras con un solo unpack_from.
+# Desde el byte 6: MAC origen, versión/IHL, longitud total, flags/desplazamiento
+# de fragmento, TTL, protocolo, IP origen.
+FRAME_HEADER = struct.Struct("!6s2xBxH2xHBB2xI")
+IP_FRAGMENT_OFFSET_MASK = 0x1FFF  # Desplazamiento distinto de 0: fragmento sin cabecera L4
+L4_PORTS = struct.Struct("!HH")  # Puertos origen/destino de TCP y UDP
+# Métodos ya enlazados: packet_callback se ahorra la búsqueda del atributo por paquete.
+unpack_frame_header = FRAME_HEADER.unpack_from
+unpack_l4_ports = L4_PORTS.unpack_from
+
+# Campo "protocol" de la cabecera IPv4 (byte 23 de la trama) -> nombre para la UI.
+PROTOCOL_NAMES = {1: "ICMP", 6: "TCP", 17: "UDP"}
+
+# Programa BPF equivalente a
+#   tcpdump -s 640 -dd 'ip and not src net 127.0.0.0/8
+#                      and not dst host 255.255.255.255 and not dst net 224.0.0.0/4'
+# El kernel descarta lo que no sea IPv4, el tráfico con origen localhost y el
+# broadcast/multicast antes de que llegue a Python, y recorta el resto a CAPTURE_SNAPLEN.
+BPF_CAPTURE_FILTER = [
+    (0x28, 0, 0, 0x0000000C),       # ldh [12]              ; EtherType
+    (0x15, 0, 8, 0x00000800),       # jeq #0x800            ; ¿IPv4? si no, descartar
+    (0x20, 0, 0, 0x0000001A),       # ld [26]               ; IP origen
+    (0x54, 0, 0, 0xFF000000),       # and #0xff000000
+    (0x15, 5, 0, 0x7F000000),       # jeq #127.0.0.0/8      ; localhost -> descartar
+    (0x20, 0, 0, 0x0000001E),       # ld [30]               ; IP destino
+    (0x15, 3, 0, 0xFFFFFFFF),       # jeq #255.255.255.255  ; broadcast -> descartar
+    (0x54, 0, 0, 0xF0000000),       # and #0xf0000000
+    (0x15, 1, 0, 0xE0000000),       # jeq #224.0.0.0/4      ; multicast -> descartar
+    (0x06, 0, 0, CAPTURE_SNAPLEN),  # ret #640              ; aceptar (recortado)
+    (0x06, 0, 0, 0x00000000),       # ret #0                ; descartar
+]
 
 # Estado Global de la Red
-network_devices = {}
+# OrderedDict usado como LRU: el dispositivo con tráfico más antiguo va primero.
+network_devices = OrderedDict()
+# Dispositivos de la tabla con estado "Blocked" (ver set_device_status): si son
+# todos, la expulsión falla al instante en lugar de recorrer la tabla entera.
+blocked_devices = 0
 lock = Lock()
 is_sniffing_running = False
+# Última respuesta de /api/network_status ya serializada en bytes UTF-8 (ver publish_network_snapshot)
+network_snapshot = None
+# Versión de la copia tomada con `lock` y de la última publicada: quien serializa
+# fuera del lock no puede pisar un snapshot más reciente con uno antiguo.
+snapshot_version = 0
+published_version = -1
+snapshot_lock = Lock()
 
 
 def initialize_devices():
     """Inicializa la estructura de datos para la auditoría."""
-    global network_devices
-    # Los dispositivos se añadirán dinámicamente al capturar paquetes.
-    network_devices = {}
+    global network_devices, blocked_devices
+    with lock:
+        # Los dispositivos se añadirán dinámicamente al capturar paquetes.
+        network_devices = OrderedDict()
+        blocked_devices = 0
+        state = copy_network_state()
+    publish_network_snapshot(state)
     print("Estado de dispositivos reseteado. Esperando tráfico en la red...")
 
 
 # --- FUNCIÓN: Extracción de Dominio (Existente) ---
-def extract_domain(pkt):
+def extract_domain(frame, frame_len, protocol_number, l4_offset, sport, dport):
     """Extrae el dominio para tráfico HTTP (Port 80) o marca HTTPS/Otros."""
-    if TCP in pkt and (pkt[TCP].dport == 80 or pkt[TCP].sport == 80) and Raw in pkt:
-        try:
-            payload = pkt[Raw].load.decode('utf-8', 'ignore')
-            for line in payload.split('\r\n'):
-                if line.lower().startswith('host:'):
-                    return line.split(': ')[1].strip()
-        except Exception:
-            return "HTTP (Error Decodificando)"
-
-    if TCP in pkt and (pkt[TCP].dport == 443 or pkt[TCP].sport == 443):
-        return "HTTPS (Dominio Cifrado)"
-    
-    if UDP in pkt and (pkt[UDP].dport == 53 or pkt[UDP].sport == 53):
-        return "DNS (Nombre Cifrado)"
+    if protocol_number == 6 and frame_len >= l4_offset + 20:
+        if dport == 80 or sport == 80:
+            # Data offset de TCP (en palabras de 32 bits) para llegar a la carga útil.
+            payload_offset = l4_offset + (frame[l4_offset + 12] >> 4) * 4
+            if payload_offset < frame_len:
+                # Una sola pasada del motor de re sobre la vista del búfer, sin
+                # copiar ni pasar a minúsculas la carga útil.
+                scan_end = min(frame_len, payload_offset + HTTP_HOST_SCAN_LIMIT)
+                match = HTTP_HOST_PATTERN.search(frame, payload_offset, scan_end)
+                if match:
+                    # Solo se decodifica el valor de la cabecera
+                    return match.group(1).decode("latin-1")
+
+        if dport == 443 or sport == 443:
+            return "HTTPS (Dominio Cifrado)"
+
+    if protocol_number == 17 and frame_len >= l4_offset + 4:
+        if dport == 53 or sport == 53:
+            return "DNS (Nombre Cifrado)"
     
     return "N/A o Protocolo No Web"
 
 
-# --- LÓGICA DE CAPTURA DE RED (SCAPY) EN HILO SEPARADO ---
+# --- LÓGICA DE CAPTURA DE RED (AF_PACKET + BPF) EN PROCESO SEPARADO ---
+
+
+def open_capture_socket(iface):
+    """Abre un socket AF_PACKET en `iface` con el filtro BPF de captura adjunto."""
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+    sock.bind((str(iface), ETH_P_IP))
+
+    # struct sock_filter { u16 code; u8 jt; u8 jf; u32 k; } y struct sock_fprog.
+    instructions = b"".join(struct.pack("HBBI", *ins) for ins in BPF_CAPTURE_FILTER)
+    program = ctypes.create_string_buffer(instructions)
+    fprog = struct.pack("HL", len(BPF_CAPTURE_FILTER), ctypes.addressof(program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    # SO_RCVBUF se recorta en silencio a net.core.rmem_max (a menudo unos pocos
+    # MiB); con CAP_NET_ADMIN forzamos el tamaño completo del búfer del kernel.
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, SOCKET_RCVBUF_BYTES)
+    except PermissionError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF_BYTES)
+    return sock
+
+
+def packet_callback(frame, frame_len, local_counts, local_bytes, last_packet, web_domains, first_domains):
+    """Acumula una trama Ethernet/IPv4 cruda en los contadores locales del ciclo.
+
+    No toma `lock`: los contadores pertenecen al proceso de captura y se aplican
+    a `network_devices` una sola vez por ciclo (ver `apply_cycle_batch`).
+    """
+    src_mac, ver_ihl, total_length, fragment, ttl, protocol_number, src_int = (
+        unpack_frame_header(frame, 6)
+    )
+    # Ciclo con demasiadas IPs origen (escaneo, IPs falsificadas): las nuevas se
+    # descartan y los contadores del ciclo no crecen sin límite.
+    packets_seen = local_counts.get(src_int, 0) + 1
+    if packets_seen == 1 and len(local_counts) >= MAX_CYCLE_SOURCES:
+        return
+
+    l4_offset = 14 + (ver_ihl & 0x0F) * 4
+
+    # Solo el primer fragmento lleva la cabecera TCP/UDP; en los demás, esos
+    # bytes son carga útil y no se interpretan como puertos ni como HTTP.
+    first_fragment = not fragment & IP_FRAGMENT_OFFSET_MASK
+
+    sport = dport = None
+    dst_port = ""
+    if first_fragment and protocol_number in (6, 17) and frame_len >= l4_offset + 4:
+        sport, dport = unpack_l4_ports(frame, l4_offset)
+        dst_port = dport
+
+    # Los contadores se indexan por la IP entera; la forma textual se calcula
+    # una sola vez por IP y ciclo en `apply_cycle_batch`.
+    local_counts[src_int] = packets_seen
+    # Longitud total del datagrama IP + cabecera Ethernet (independiente del búfer)
+    local_bytes[src_int] += total_length + 14
+    # Solo se conserva el último paquete del ciclo: MAC, TTL, protocolo y puerto.
+    last_packet[src_int] = (src_mac, ttl, protocol_number, dst_port)
+
+    # --- ACTUALIZAR DOMINIO SOLO SI ES TRÁFICO WEB (No N/A) ---
+    if first_fragment:
+        domain = extract_domain(frame, frame_len, protocol_number, l4_offset, sport, dport)
+    else:
+        domain = "N/A o Protocolo No Web"
+    # Etiqueta del primer paquete de la IP en el ciclo: la usa el registro de un
+    # dispositivo nuevo (p. ej. "DNS (Nombre Cifrado)" para un host solo DNS).
+    if packets_seen == 1:
+        first_domains[src_int] = domain
+    if domain not in ["N/A o Protocolo No Web", "DNS (Nombre Cifrado)"]:
+        web_domains[src_int] = domain
+    # ---------------------------------------------------------
+
+
+def new_device_record(src_int, src_ip, mac_bytes, manufacturer, os_fingerprint, protocol, dst_port,
+                      domain="N/A o Protocolo No Web"):
+    """Construye el registro de un dispositivo recién visto."""
+    # El último octeto sale directamente de la IP entera, sin split() de cadenas.
+    last_octet = src_int & 0xFF
+
+    return {
+        # El tráfico de localhost ya lo descarta el filtro BPF del socket
+        "id": f"HOST-{last_octet}",
+        "ip": src_ip,
+        # La MAC solo se formatea como texto al crear el registro
+        "macAddress": mac_bytes.hex(":"),     
+        "manufacturer": manufacturer, 
+        "os_fingerprint": os_fingerprint,     
+        "status": "Connected",
+        "packetCount": 0,
+        "recentPacketHistory": deque(maxlen=DETECTION_WINDOW_SIZE),
+        "window_sum": 0, # Suma móvil de recentPacketHistory
+        "bandwidthHistoryTotal": 0,          
+        "recentBandwidthRate": deque(maxlen=DETECTION_WINDOW_SIZE),
+        "packetLimit": DEFAULT_PACKET_LIMIT,
+        "last_protocol": protocol,
+        "last_port": dst_port,
+        "is_local": is_private_ip(src_int),
+        # --- ASIGNACIÓN DE TIPO DE DISPOSITIVO (SIMULADA) ---
+        "deviceType": DEVICE_TYPES_MAP[last_octet % len(DEVICE_TYPES_MAP)],
+        "last_visited_domain": domain, 
+    }
+
+
+def prepare_cycle_batch(local_counts, local_bytes, last_packet, web_domains, first_domains):
+    """Resuelve, sin tomar `lock`, todo lo del lote que no depende de `network_devices`.
+
+    Devuelve una lista de actualizaciones por IP para `apply_cycle_batch`, de modo
+    que la sección crítica solo inserta registros y suma contadores.
+    """
+    updates = []
+    new_candidates = 0
+    for src_int, packets_sent_this_cycle in local_counts.items():
+        src_ip = socket.inet_ntoa(struct.pack("!I", src_int))
+
+        # Lectura sin lock: solo decide si conviene preconstruir el registro.
+        # apply_cycle_batch lo vuelve a comprobar con el lock tomado.
+        is_new = src_ip not in network_devices
+        if is_new:
+            # Más IPs nuevas de las que apply_cycle_batch admitirá en este ciclo:
+            # se descartan aquí, sin construir registros que nunca entrarían.
+            if new_candidates >= MAX_NEW_DEVICES_PER_CYCLE:
+                continue
+            new_candidates += 1
+
+        mac_bytes, ttl, protocol_number, dst_port = last_packet[src_int]
+
+        # --- Extracción de Huella de SO y Fabricante (una vez por IP y ciclo) ---
+        os_fingerprint = get_os_fingerprint(ttl)
+        manufacturer = get_manufacturer(mac_bytes)
+        # -------------------------------------------------------------------------
+
+        protocol = PROTOCOL_NAMES.get(protocol_number, "Otros")
+
+        first_domain = first_domains[src_int]
+        candidate = None
+        if is_new:
+            candidate = new_device_record(
+                src_int, src_ip, mac_bytes, manufacturer, os_fingerprint, protocol, dst_port,
+                first_domain,
+            )
+
+        updates.append((
+            src_int, src_ip, packets_sent_this_cycle, local_bytes[src_int],
+            protocol, dst_port, mac_bytes, manufacturer, os_fingerprint,
+            web_domains.get(src_int), first_domain, candidate,
+        ))
+    return updates
+
 
+def set_device_status(device, status):
+    """Cambia el estado del dispositivo manteniendo `blocked_devices`. Llamar con `lock` tomado."""
+    global blocked_devices
 
-def packet_callback(pkt):
-    """Función de callback de Scapy: se llama para cada paquete capturado."""
+    if device["status"] == status:
+        return
+    blocked_devices += 1 if status == "Blocked" else -1
+    device["status"] = status
+
+
+def evict_least_recent_device():
+    """Expulsa el dispositivo no bloqueado menos reciente. Llamar con `lock` tomado.
+
+    Devuelve False si todos los dispositivos de la tabla están bloqueados.
+    """
+    if blocked_devices >= len(network_devices):
+        return False
+
+    while True:
+        ip, device = next(iter(network_devices.items()))
+        if device["status"] != "Blocked":
+            del network_devices[ip]
+            return True
+        # Un bloqueo nunca se pierde por falta de espacio: se aparta al final
+        # para no volver a revisarlo en la próxima expulsión.
+        network_devices.move_to_end(ip)
+
+
+def apply_cycle_batch(updates):
+    """Aplica a `network_devices` las actualizaciones de un ciclo. Llamar con `lock` tomado."""
     global network_devices
 
-    # Solo procesamos paquetes IP con capa de origen y Ethernet para la MAC/Longitud.
-    if IP in pkt and hasattr(pkt[IP], "src") and Ether in pkt:
-        src_ip = pkt[IP].src
-        src_mac = pkt[Ether].src 
-        packet_length = len(pkt) # Longitud del paquete en bytes
-        
-        # --- Extracción de Huella de SO ---
-        os_fingerprint = get_os_fingerprint(pkt[IP].ttl) 
-        # ----------------------------------
-
-        # --- Extracción del Dominio (Existente) ---
-        domain = extract_domain(pkt)
-        # -----------------------------
-
-        # --- Extracción del Fabricante (NUEVO) ---
-        manufacturer = get_manufacturer(src_mac)
-        # -----------------------------
-
-        with lock:
-            # --- Extracción de información detallada (existente) ---
-            protocol = (
-                "ICMP"
-                if pkt.haslayer("ICMP")
-                else (
-                    "TCP"
-                    if pkt.haslayer(TCP)
-                    else ("UDP" if pkt.haslayer(UDP) else "Otros")
+    new_devices = 0
+    table_full = False
+    for (src_int, src_ip, packets_sent_this_cycle, bytes_sent_this_cycle,
+         protocol, dst_port, mac_bytes, manufacturer, os_fingerprint,
+         domain, first_domain, candidate) in updates:
+
+        # 1. Incorporar nuevos dispositivos encontrados
+        device = network_devices.get(src_ip)
+        if device is not None:
+            network_devices.move_to_end(src_ip)
+        else:
+            # Un escaneo o IPs falsificadas no pueden hacer crecer la tabla sin límite
+            if table_full or new_devices >= MAX_NEW_DEVICES_PER_CYCLE:
+                continue
+            if len(network_devices) >= MAX_DEVICES and not evict_least_recent_device():
+                # Tabla llena de dispositivos bloqueados: no se admiten más en este ciclo
+                table_full = True
+                continue
+            new_devices += 1
+
+            if candidate is None:
+                # La tabla cambió (p. ej. un reinicio) tras preparar el lote
+                candidate = new_device_record(
+                    src_int, src_ip, mac_bytes, manufacturer, os_fingerprint, protocol, dst_port,
+                    first_domain,
                 )
+            device = network_devices[src_ip] = candidate
+
+        # 2. Solo contar si el dispositivo no está bloqueado
+        if device["status"] == "Blocked":
+            continue
+
+        device["packetCount"] += packets_sent_this_cycle
+        device["last_protocol"] = protocol
+        device["last_port"] = dst_port
+
+        # Actualizar metadatos
+        if device["os_fingerprint"] in ["Desconocido/Router", "Linux/Unix (TTL ~64)"]: 
+             device["os_fingerprint"] = os_fingerprint
+        if device["macAddress"] == "00:00:00:00:00:00" or device["manufacturer"] == "N/A":
+             device["macAddress"] = mac_bytes.hex(":")
+             device["manufacturer"] = manufacturer
+
+        # NUEVO: Sumar bytes al total
+        device["bandwidthHistoryTotal"] += bytes_sent_this_cycle
+
+        if domain is not None:
+            device["last_visited_domain"] = domain
+
+        # 3. Registrar el ciclo para la detección de tasa (paquetes y ancho de banda).
+        # Los deque tienen maxlen=DETECTION_WINDOW_SIZE: el más antiguo sale solo,
+        # y la suma móvil resta ese valor expulsado en lugar de recalcular sum().
+        history = device["recentPacketHistory"]
+        evicted = history[0] if len(history) == history.maxlen else 0
+        history.append(packets_sent_this_cycle)
+        device["window_sum"] += packets_sent_this_cycle - evicted
+        device["recentBandwidthRate"].append(bytes_sent_this_cycle)
+
+        # 4. La ventana cambió: solo este dispositivo necesita la detección de tasa
+        check_rate_limit(src_ip, device)
+
+
+def check_rate_limit(ip, device):
+    """Bloquea el dispositivo si su ventana supera el límite. Llamar con `lock` tomado.
+
+    Solo se invoca cuando cambian `window_sum` o `packetLimit`, en lugar de
+    recorrer todos los dispositivos en cada petición del frontend.
+    """
+    if device["status"] == "Blocked":
+        return
+
+    # --- DETECCIÓN POR TASA DE PAQUETES (Existente) ---
+    current_rate = device["window_sum"]
+
+    if current_rate > device["packetLimit"]:
+        # ¡DETECCIÓN DE DESVÍO POR TASA RÁPIDA!
+        set_device_status(device, "Blocked")
+        device["recentPacketHistory"].clear()  # Limpiar historial
+        device["window_sum"] = 0
+        device["recentBandwidthRate"].clear()
+
+        print(
+            f"[CRÍTICO] BLOQUEADO: {ip}. Paquetes en ventana exceden límite: {current_rate} > {device['packetLimit']}"
+        )
+
+
+def pin_to_nic_numa_node(iface):
+    """Fija el proceso actual a las CPUs del nodo NUMA de `iface`.
+
+    Devuelve el conjunto de CPUs aplicado, o None si la interfaz no expone nodo
+    NUMA (interfaces virtuales, equipos de un solo nodo).
+    """
+    try:
+        with open(f"/sys/class/net/{iface}/device/numa_node") as f:
+            node = int(f.read())
+        if node < 0:
+            return None
+
+        # Formato de cpulist: "0-3,8-11"
+        with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+            cpus = set()
+            for part in f.read().strip().split(","):
+                first, _, last = part.partition("-")
+                cpus.update(range(int(first), int(last or first) + 1))
+    except (OSError, ValueError):
+        return None
+
+    # Respetar las restricciones previas (taskset, cgroups)
+    cpus &= os.sched_getaffinity(0)
+    if not cpus:
+        return None
+    os.sched_setaffinity(0, cpus)
+    return cpus
+
+
+def capture_loop(sock, batch_queue):
+    """Vacía `sock` y envía a `batch_queue` los contadores de cada ciclo."""
+    # Búfer preasignado: recv_into escribe siempre sobre la misma memoria, y la
+    # vista permite recortar la carga útil sin copiarla.
+    buf = bytearray(RECV_BUFFER_SIZE)
+    view = memoryview(buf)
+
+    # epoll con disparo por flanco: despertamos solo cuando el kernel encola
+    # paquetes nuevos y entonces vaciamos el socket hasta EWOULDBLOCK.
+    sock.setblocking(False)
+    poller = select.epoll()
+    poller.register(sock.fileno(), select.EPOLLIN | select.EPOLLET)
+    # True si el ciclo anterior cortó el vaciado y aún quedan paquetes encolados.
+    pending = False
+
+    # Alias locales para el bucle de vaciado: en CPython una variable local es
+    # más barata que resolver un global o un atributo en cada paquete.
+    recv_into = sock.recv_into
+    dontwait = socket.MSG_DONTWAIT
+    callback = packet_callback
+    monotonic = time.monotonic
+
+    while True:
+        # Contadores locales del ciclo: se crean nuevos en cada ciclo porque la
+        # cola serializa el lote en segundo plano después de put().
+        local_counts = Counter()
+        local_bytes = Counter()
+        last_packet = {}
+        web_domains = {}
+        first_domains = {}
+
+        try:
+            print("DEBUG: Entrando al ciclo de captura del socket...")
+            captured = 0
+            deadline = monotonic() + SNIFF_TIMEOUT_S
+
+            while True:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                if not pending and not poller.poll(remaining):
+                    continue
+                pending = False
+
+                while True:
+                    try:
+                        n = recv_into(view, 0, dontwait)
+                    except BlockingIOError:
+                        break
+
+                    if n < MIN_IPV4_FRAME_LEN:
+                        continue
+
+                    callback(view, n, local_counts, local_bytes, last_packet, web_domains, first_domains)
+                    captured += 1
+
+                    # Bajo una ráfaga continua el socket nunca se vacía: cerramos
+                    # el ciclo a tiempo y retomamos el vaciado sin esperar a epoll.
+                    if captured % DRAIN_DEADLINE_CHECK == 0 and monotonic() >= deadline:
+                        pending = True
+                        break
+
+        except Exception as e:
+            # FIX: Se incluye la variable e en el print para visibilidad
+            print(
+                f"ERROR CRÍTICO en proceso de captura. Deteniendo auditoría de red: {e} (Tipo: {type(e)})" # <-- MEJORA LOGGING
+            )
+            break
+
+        if not local_counts:
+            print(
+                f"DEBUG: 0 paquetes capturados en el ciclo de {SNIFF_TIMEOUT_S}s."
             )
+        batch_queue.put((local_counts, local_bytes, last_packet, web_domains, first_domains))
+
+    poller.close()
+    sock.close()
+
+
+def sniffing_process(iface, batch_queue, parent_pid):
+    """Proceso de captura: lee del socket AF_PACKET y envía un lote por ciclo.
+
+    Corre fuera del proceso de Flask, así que la captura no compite por el GIL
+    con las peticiones HTTP. Cada `SNIFF_TIMEOUT_S` se envían a `batch_queue`
+    los contadores del ciclo, que el proceso principal aplica con `apply_cycle_batch`.
+    """
+    # Ctrl+C lo gestiona el proceso principal; este proceso es un demonio.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Con fork se heredan los manejadores de Python del padre (p. ej. los del
+    # worker de gunicorn); SIGTERM debe volver a terminar este proceso.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # daemon=True solo sirve si el padre sale limpiamente: si muere por SIGKILL
+    # (p. ej. timeout de gunicorn) este proceso seguiría capturando como root.
+    # PR_SET_PDEATHSIG hace que el kernel nos envíe SIGTERM en ese caso.
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM) != 0:
+        print(f"ALERTA: No se pudo activar PR_SET_PDEATHSIG: {os.strerror(ctypes.get_errno())}")
+    # El padre pudo morir antes de activar la señal.
+    if os.getppid() != parent_pid:
+        return
 
-            dst_port = ""
-            if TCP in pkt:
-                dst_port = pkt[TCP].dport
-            elif UDP in pkt:
-                dst_port = pkt[UDP].dport
-
-            # 1. Incorporar nuevos dispositivos encontrados
-            if src_ip not in network_devices:
-                # --- ASIGNACIÓN DE TIPO DE DISPOSITIVO (SIMULADA) ---
-                try:
-                    octet = int(src_ip.split('.')[-1])
-                    device_type = DEVICE_TYPES_MAP[octet % len(DEVICE_TYPES_MAP)]
-                except ValueError:
-                    device_type = DEVICE_TYPES_MAP[0] # Fallback
-                # -----------------------------------------------------------
-
-                network_devices[src_ip] = {
-                    # La IP 127.0.0.1 se maneja para evitar spam de localhost
-                    "id": f"HOST-{src_ip.split('.')[-1]}"
-                    if src_ip != "127.0.0.1"
-                    else "LOCALHOST (127.0.0.1)",
-                    "ip": src_ip,
-                    "macAddress": src_mac,     
-                    "manufacturer": manufacturer, 
-                    "os_fingerprint": os_fingerprint,     
-                    "status": "Connected",
-                    "packetCount": 0,
-                    "recentPacketHistory": [],
-                    "bandwidthHistoryTotal": 0,          
-                    "recentBandwidthRate": [],           
-                    "packetLimit": DEFAULT_PACKET_LIMIT,
-                    "last_protocol": protocol,
-                    "last_port": dst_port,
-                    "is_local": src_ip.startswith("192.168.")
-                    or src_ip.startswith("10.")
-                    or src_ip.startswith("172."),
-                    "deviceType": device_type,
-                    "last_visited_domain": domain, 
-                    "packetLengthThisCycle": [], # Inicialización correcta para dispositivos nuevos
-                }
-            
-            # 2. Solo contar si el dispositivo no está bloqueado
-            device = network_devices[src_ip]
-            
-            # FIX DEFENSA DENTRO DEL CALLBACK: Si un dispositivo existente no tiene el campo, inicializarlo.
-            if "packetLengthThisCycle" not in device:
-                device["packetLengthThisCycle"] = []
-                
-            if device["status"] != "Blocked":
-                device["packetCount"] += 1
-                device["last_protocol"] = protocol
-                device["last_port"] = dst_port
-                
-                # Actualizar metadatos
-                if device["os_fingerprint"] in ["Desconocido/Router", "Linux/Unix (TTL ~64)"]: 
-                     device["os_fingerprint"] = os_fingerprint
-                if device["macAddress"] == "00:00:00:00:00:00" or device["manufacturer"] == "N/A":
-                     device["macAddress"] = src_mac
-                     device["manufacturer"] = manufacturer
-                     
-                # NUEVO: Sumar bytes al total
-                device["bandwidthHistoryTotal"] += packet_length
-                
-                # NUEVO: Añadir longitud del paquete a un historial temporal
-                device["packetLengthThisCycle"].append(packet_length) 
-
-                # --- ACTUALIZAR DOMINIO SOLO SI ES TRÁFICO WEB (No N/A) ---
-                if domain not in ["N/A o Protocolo No Web", "DNS (Nombre Cifrado)"]:
-                    device["last_visited_domain"] = domain
-                # ---------------------------------------------------------
+    print(
+        f"INFO: Proceso de auditoría real iniciado en {iface}. Capturando tráfico IP..."
+    )
+
+    # Mantener la captura en el mismo nodo NUMA que la NIC y sus interrupciones
+    # conserva calientes el anillo RX, los búferes y las cachés del intérprete.
+    cpus = pin_to_nic_numa_node(iface)
+    if cpus:
+        print(f"INFO: Proceso de captura fijado a las CPUs {sorted(cpus)} (nodo NUMA de {iface}).")
+
+    try:
+        sock = open_capture_socket(iface)
+    except Exception as e:
+        print(
+            f"ERROR CRÍTICO al abrir el socket de captura. Deteniendo auditoría de red: {e} (Tipo: {type(e)})"
+        )
+        return
+
+    capture_loop(sock, batch_queue)
+    print("INFO: Proceso de auditoría real detenido.")
 
 
 def start_continuous_sniffing():
-    """Inicia el bucle de captura de Scapy en un hilo dedicado."""
+    """Inicia el proceso de captura y el hilo que aplica sus lotes a `network_devices`."""
     global is_sniffing_running
 
     if is_sniffing_running:
         return
 
-    def sniffing_loop():
-        global is_sniffing_running
-        is_sniffing_running = True
-        print(
-            f"INFO: Hilo de auditoría real iniciado en {ACTIVE_INTERFACE}. Capturando tráfico IP..."
-        )
-
-        while is_sniffing_running:
-            # Antes de empezar un ciclo, preparamos para acumular bytes del ciclo actual.
-            with lock:
-                for device in network_devices.values():
-                    # FIX DEFENSA ANTES DE RESET: Inicializa el campo si no existe (para dispositivos antiguos)
-                    if "packetLengthThisCycle" not in device:
-                        device["packetLengthThisCycle"] = []
+    # "fork" de forma explícita: con "spawn" el hijo reimportaría este módulo y
+    # volvería a arrancar Flask. AF_PACKET solo existe en Linux de todos modos.
+    mp_context = multiprocessing.get_context("fork")
+    batch_queue = mp_context.Queue()
+    process = mp_context.Process(
+        target=sniffing_process,
+        args=(str(ACTIVE_INTERFACE), batch_queue, os.getpid()),
+        daemon=True,
+    )
+    process.start()
+    is_sniffing_running = True
 
-                    # Inicializar/Resetear el acumulador de bytes del ciclo actual
-                    device["packetLengthThisCycle"] = [] 
+    def batch_consumer_loop():
+        global is_sniffing_running
 
+        while process.is_alive():
             try:
-                print("DEBUG: Entrando al bloque sniff() de Scapy...") # <-- NUEVO DEBUG PRINT
-                # Captura de paquetes IP (L3). Llama a packet_callback.
-                packets = sniff(
-                    prn=packet_callback,
-                    filter="ip", 
-                    iface=ACTIVE_INTERFACE,
-                    timeout=SNIFF_TIMEOUT_S,
-                )
+                batch = batch_queue.get(timeout=SNIFF_TIMEOUT_S)
+            except queue.Empty:
+                continue
 
-                if len(packets) == 0:
-                    print(
-                        f"DEBUG: 0 paquetes capturados en el ciclo de {SNIFF_TIMEOUT_S}s."
-                    )
+            updates = prepare_cycle_batch(*batch)
 
-            except Exception as e:
-                # FIX: Se incluye la variable e en el print para visibilidad
-                print(
-                    f"ERROR CRÍTICO en hilo de Scapy. Deteniendo auditoría de red: {e} (Tipo: {type(e)})" # <-- MEJORA LOGGING
-                )
-                is_sniffing_running = False  # Detener el hilo si falla
-                break
-                
-            # Después del sniffing, calculamos la tasa
+            # Una sola adquisición de `lock` por ciclo de captura.
             with lock:
-                for device in network_devices.values():
-                    # Añadir defensa para campos nuevos por si fallan en el reinicio
-                    if "recentBandwidthRate" not in device: device["recentBandwidthRate"] = []
-                    if "recentPacketHistory" not in device: device["recentPacketHistory"] = []
-
-                    if device["status"] != "Blocked":
-                        # NUEVO: Sumar el total de bytes capturados en ESTE ciclo
-                        # La defensa se hizo antes, así que este campo existe
-                        bytes_sent_this_cycle = sum(device["packetLengthThisCycle"])
-                        
-                        # 2. Registrar solo ciclos con tráfico para la detección de tasa
-                        if bytes_sent_this_cycle > 0:
-                            # Tasa de Paquetes (Existente)
-                            packets_sent_this_cycle = len(device["packetLengthThisCycle"])
-                            device["recentPacketHistory"].append(packets_sent_this_cycle)
-                            
-                            # Tasa de Ancho de Banda (NUEVO)
-                            device["recentBandwidthRate"].append(bytes_sent_this_cycle)
-                        
-                        # 3. Mantener el historial solo dentro de la ventana de detección
-                        if len(device["recentPacketHistory"]) > DETECTION_WINDOW_SIZE:
-                            device["recentPacketHistory"].pop(0)
-                        if len(device["recentBandwidthRate"]) > DETECTION_WINDOW_SIZE:
-                            device["recentBandwidthRate"].pop(0)
-
-            # Pequeña pausa
-            time.sleep(0.1)
+                apply_cycle_batch(updates)
+                state = copy_network_state()
+            publish_network_snapshot(state)
+
+        is_sniffing_running = False
         print("INFO: Hilo de auditoría real detenido.")
 
-    # Iniciar el hilo y hacerlo un demonio
-    thread = Thread(target=sniffing_loop)
+    # Iniciar el hilo consumidor y hacerlo un demonio
+    thread = Thread(target=batch_consumer_loop)
     thread.daemon = True
     thread.start()
     
-    # NUEVO DEBUG: Esperar un momento para que el hilo falle y el error se imprima
+    # NUEVO DEBUG: Esperar un momento para que el proceso falle y el error se imprima
     time.sleep(1) 
     
-    # NUEVO DEBUG: Comprobar el estado del hilo justo después de la espera
-    if not thread.is_alive():
-        print("ALERTA: El hilo de auditoría falló inmediatamente después de iniciar. El error DEBE estar arriba.")
+    # NUEVO DEBUG: Comprobar el estado del proceso justo después de la espera
+    if not process.is_alive():
+        print("ALERTA: El proceso de auditoría falló inmediatamente después de iniciar. El error DEBE estar arriba.")
 
 
 # --- LÓGICA DE DETECCIÓN Y REPORTE (LLAMADA POR EL FRONTEND) ---
 
 
-def update_network_status():
-    """Ejecuta la detección de tasa y formatea la respuesta basada en datos reales."""
-    global network_devices
+def serialize_device(device):
+    """Copia el dispositivo convirtiendo los historiales (deque) a listas JSON."""
+    data = {
+        **device,
+        "recentPacketHistory": list(device["recentPacketHistory"]),
+        "recentBandwidthRate": list(device["recentBandwidthRate"]),
+    }
+    # Campo interno de la detección de tasa: no forma parte de la API
+    del data["window_sum"]
+    return data
 
-    if not is_sniffing_running:
-        # Si el hilo de sniffing falló o no se inició, no tenemos datos.
-        raise Exception(
-            "El hilo de auditoría real no está activo. Verifique los logs de error."
-        )
 
-    with lock:
-        # Procesar el tráfico y aplicar la detección
-        for ip, device in list(network_devices.items()):
-            if device["status"] == "Blocked":
-                continue
+def copy_network_state():
+    """Copia superficial del estado para serializarla fuera de `lock`. Llamar con `lock` tomado."""
+    global snapshot_version
 
-            # --- DETECCIÓN POR TASA DE PAQUETES (Existente) ---
-            
-            # 4. Detección por Tasa de Paquetes
-            # Añadir defensa para campos nuevos en el bucle principal (para un reinicio limpio)
-            if "recentPacketHistory" not in device: device["recentPacketHistory"] = []
+    snapshot_version += 1
+    # Formatear la respuesta para el frontend
+    return snapshot_version, [serialize_device(device) for device in network_devices.values()]
 
-            current_rate = sum(device["recentPacketHistory"])
 
-            if current_rate > device["packetLimit"]:
-                # ¡DETECCIÓN DE DESVÍO POR TASA RÁPIDA!
-                device["status"] = "Blocked"
-                device["recentPacketHistory"] = []  # Limpiar historial
-                # Añadir defensa para campos nuevos
-                if "recentBandwidthRate" in device: device["recentBandwidthRate"] = []  
+def publish_network_snapshot(state):
+    """Serializa una copia de `copy_network_state` para /api/network_status. Llamar sin `lock`.
 
-                print(
-                    f"[CRÍTICO] BLOQUEADO: {ip}. Paquetes en ventana exceden límite: {current_rate} > {device['packetLimit']}"
-                )
+    Se ejecuta una vez por ciclo y tras cada cambio desde el frontend; las
+    peticiones GET solo leen esta referencia, sin `lock` y sin volver a serializar.
+    """
+    global network_snapshot, published_version
 
-    # Formatear la respuesta para el frontend
-    device_list = list(network_devices.values())
+    version, device_list = state
 
     # El status ahora es simple
     status = {
@@ -370,18 +743,53 @@ def update_network_status():
         "simulating": False,  # Siempre Falso
     }
 
-    return device_list, status
+    # La serialización (la parte cara) ya no bloquea la captura ni la API.
+    # Se guardan bytes UTF-8: la respuesta los sirve tal cual, sin que Werkzeug
+    # vuelva a codificar el texto en cada petición.
+    # orjson ya produce bytes: sin el decode del proveedor ni un encode de vuelta.
+    payload = orjson.dumps(
+        {"devices": device_list, "status": status}, default=app.json.default
+    )
+
+    with snapshot_lock:
+        if version > published_version:
+            # Una sola asignación: los lectores ven el snapshot anterior o el nuevo, nunca uno a medias.
+            network_snapshot = payload
+            published_version = version
+
+
+def update_network_status():
+    """Devuelve el último estado publicado, ya serializado en JSON."""
+    if not is_sniffing_running:
+        # Si el proceso de captura falló o no se inició, no tenemos datos.
+        raise Exception(
+            "El proceso de auditoría real no está activo. Verifique los logs de error."
+        )
+
+    return network_snapshot
 
 
 # --- CONFIGURACIÓN DE FLASK ---
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask basado en orjson (usado por `jsonify`)."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Inicializar los dispositivos al arrancar el servidor
 initialize_devices()
 
-# Iniciar la auditoría de Scapy en el hilo separado
+# Iniciar la auditoría de red en el proceso separado
 start_continuous_sniffing()
 
 print("Iniciando servidor Flask en http://127.0.0.1:5000...")
@@ -391,16 +799,32 @@ print("Iniciando servidor Flask en http://127.0.0.1:5000...")
 def get_network_status():
     """Endpoint principal para que React obtenga el estado de la red."""
     try:
-        device_list, status = update_network_status()
-        return jsonify({"devices": device_list, "status": status})
+        return Response(update_network_status(), mimetype="application/json")
     except Exception as e:
-        # Esto captura errores si el hilo de sniffing se detiene inesperadamente
+        # Esto captura errores si el proceso de captura se detiene inesperadamente
         print(f"ERROR: Fallo en la actualización de estado: {e}")
         return jsonify(
             {"devices": [], "status": {"isRunning": False, "simulating": False}}
         ), 500
 
 
+def parse_packet_limit(limit):
+    """Convierte el límite recibido a un entero positivo, o None si no es válido."""
+    # Camino rápido: el frontend envía un número JSON (parseInt), que llega como int.
+    # bool es subclase de int: `true` no es un límite válido.
+    if isinstance(limit, int) and not isinstance(limit, bool):
+        new_limit = limit
+    elif isinstance(limit, str):
+        digits = limit.strip()
+        # int() rechaza cadenas de más de 4300 dígitos; ningún límite real se acerca.
+        if not (0 < len(digits) <= PACKET_LIMIT_MAX_DIGITS and digits.isdecimal()):
+            return None
+        new_limit = int(digits)
+    else:
+        return None
+    return new_limit if new_limit > 0 else None
+
+
 @app.route("/api/device_action", methods=["POST"])
 def device_action():
     """Endpoint para bloquear/desbloquear y cambiar límites desde el frontend."""
@@ -410,32 +834,34 @@ def device_action():
     limit = data.get("limit")
 
     with lock:
-        if ip in network_devices:
-            device = network_devices[ip]
+        device = network_devices.get(ip)
+        if device is not None:
 
             if action == "block":
-                device["status"] = "Blocked"
+                set_device_status(device, "Blocked")
                 print(f"ACCION: Dispositivo {ip} BLOQUEADO manualmente.")
             elif action == "unblock":
-                device["status"] = "Connected"
+                set_device_status(device, "Connected")
                 print(f"ACCION: Dispositivo {ip} DESBLOQUEADO manualmente.")
 
-            if limit is not None:
-                try:
-                    new_limit = int(limit)
-                    if new_limit > 0:
-                        device["packetLimit"] = new_limit
-                        print(
-                            f"ACCION: Límite de paquetes de {ip} actualizado a {new_limit}."
-                        )
-                except ValueError:
-                    pass
-
-            return jsonify({"success": True, "device": device})
-        else:
-            return jsonify(
-                {"success": False, "message": "Dispositivo no encontrado"}
-            ), 404
+            new_limit = parse_packet_limit(limit)
+            if new_limit is not None:
+                device["packetLimit"] = new_limit
+                print(
+                    f"ACCION: Límite de paquetes de {ip} actualizado a {new_limit}."
+                )
+                check_rate_limit(ip, device)
+
+            device = serialize_device(device)
+            state = copy_network_state()
+
+    if device is None:
+        return jsonify(
+            {"success": False, "message": "Dispositivo no encontrado"}
+        ), 404
+
+    publish_network_snapshot(state)
+    return jsonify({"success": True, "device": device})
 
 
 @app.route("/api/reset", methods=["POST"])
@@ -447,5 +873,7 @@ def reset_simulation():
 
 
 if __name__ == "__main__":
-    # use_reloader=False es necesario para evitar que el hilo de Scapy se inicie dos veces.
-    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
\ No newline at end of file
+    # Servidor de desarrollo. En producción: `gunicorn -w 1 -k gthread --threads 8`
+    # (ver README); un solo worker porque el estado de la red vive en este proceso.
+    # use_reloader=False es necesario para evitar que el proceso de captura se inicie dos veces.
+    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True, use_reloader=False)
\ No newline at end of file